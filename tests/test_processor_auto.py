@@ -21,115 +21,122 @@ import unittest
 from pathlib import Path
 from shutil import copyfile
 
-from huggingface_hub import Repository, delete_repo, login
+from huggingface_hub import Repository, delete_repo, login, snapshot_download
+from parameterized import parameterized
 from requests.exceptions import HTTPError
-from transformers import AutoProcessor, AutoTokenizer, Wav2Vec2Config, Wav2Vec2FeatureExtractor, Wav2Vec2Processor
+from transformers import (
+    AutoProcessor,
+    Wav2Vec2Config,
+    Wav2Vec2CTCTokenizer,
+    Wav2Vec2FeatureExtractor,
+    Wav2Vec2Processor,
+)
 from transformers.file_utils import FEATURE_EXTRACTOR_NAME, is_tokenizers_available
 from transformers.testing_utils import PASS, USER, is_staging_test
 from transformers.tokenization_utils import TOKENIZER_CONFIG_FILE
 
 
-sys.path.append(str(Path(__file__).parent.parent / "utils"))
+_HERE = Path(__file__).resolve().parent
+
+UTILS_DIR = str(_HERE.parent / "utils")
+if UTILS_DIR not in sys.path:
+    sys.path.append(UTILS_DIR)
 
 from test_module.custom_feature_extraction import CustomFeatureExtractor  # noqa E402
 from test_module.custom_processing import CustomProcessor  # noqa E402
 from test_module.custom_tokenization import CustomTokenizer  # noqa E402
 
+SAMPLE_PROCESSOR_CONFIG = str(_HERE / "fixtures/dummy_feature_extractor_config.json")
+SAMPLE_VOCAB = str(_HERE / "fixtures/vocab.json")
 
-SAMPLE_PROCESSOR_CONFIG = os.path.join(
-    os.path.dirname(os.path.abspath(__file__)), "fixtures/dummy_feature_extractor_config.json"
-)
-SAMPLE_VOCAB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures/vocab.json")
+SAMPLE_FEATURE_EXTRACTION_CONFIG_DIR = str(_HERE / "fixtures")
 
-SAMPLE_FEATURE_EXTRACTION_CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
 
+def _link_or_copy(src, dst):
+    # fixtures are never modified by the tests, so a symlink is enough when the platform supports it
+    try:
+        os.symlink(src, dst)
+    except (OSError, NotImplementedError):
+        copyfile(src, dst)
 
-class AutoFeatureExtractorTest(unittest.TestCase):
-    def test_processor_from_model_shortcut(self):
-        processor = AutoProcessor.from_pretrained("facebook/wav2vec2-base-960h")
-        self.assertIsInstance(processor, Wav2Vec2Processor)
 
-    def test_processor_from_local_directory_from_repo(self):
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            model_config = Wav2Vec2Config()
-            processor = AutoProcessor.from_pretrained("facebook/wav2vec2-base-960h")
+def _save_local_processor(tmpdirname):
+    feature_extractor = Wav2Vec2FeatureExtractor()
+    tokenizer = Wav2Vec2CTCTokenizer(SAMPLE_VOCAB)
 
-            # save in new folder
-            model_config.save_pretrained(tmpdirname)
-            processor.save_pretrained(tmpdirname)
+    processor = Wav2Vec2Processor(feature_extractor, tokenizer)
+    processor.save_pretrained(tmpdirname)
 
-            processor = AutoProcessor.from_pretrained(tmpdirname)
 
-        self.assertIsInstance(processor, Wav2Vec2Processor)
+def _drop_processor_class(tmpdirname, config_file):
+    config_path = Path(tmpdirname) / config_file
+    config_dict = json.loads(config_path.read_text())
+    config_dict.pop("processor_class", None)
+    config_path.write_text(json.dumps(config_dict, indent=2))
 
-    def test_processor_from_local_directory_from_extractor_config(self):
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            # copy relevant files
-            copyfile(SAMPLE_PROCESSOR_CONFIG, os.path.join(tmpdirname, FEATURE_EXTRACTOR_NAME))
-            copyfile(SAMPLE_VOCAB, os.path.join(tmpdirname, "vocab.json"))
 
-            processor = AutoProcessor.from_pretrained(tmpdirname)
+def _from_saved_processor(tmpdirname):
+    Wav2Vec2Config().save_pretrained(tmpdirname)
+    _save_local_processor(tmpdirname)
 
-        self.assertIsInstance(processor, Wav2Vec2Processor)
 
-    def test_processor_from_feat_extr_processor_class(self):
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            feature_extractor = Wav2Vec2FeatureExtractor()
-            tokenizer = AutoTokenizer.from_pretrained("facebook/wav2vec2-base-960h")
-
-            processor = Wav2Vec2Processor(feature_extractor, tokenizer)
-
-            # save in new folder
-            processor.save_pretrained(tmpdirname)
-
-            # drop `processor_class` in tokenizer
-            with open(os.path.join(tmpdirname, TOKENIZER_CONFIG_FILE), "r") as f:
-                config_dict = json.load(f)
-                config_dict.pop("processor_class")
-
-            with open(os.path.join(tmpdirname, TOKENIZER_CONFIG_FILE), "w") as f:
-                f.write(json.dumps(config_dict))
-
-            processor = AutoProcessor.from_pretrained(tmpdirname)
+def _from_extractor_config(tmpdirname):
+    # copy relevant files
+    _link_or_copy(SAMPLE_PROCESSOR_CONFIG, os.path.join(tmpdirname, FEATURE_EXTRACTOR_NAME))
+    _link_or_copy(SAMPLE_VOCAB, os.path.join(tmpdirname, "vocab.json"))
 
-        self.assertIsInstance(processor, Wav2Vec2Processor)
 
-    def test_processor_from_tokenizer_processor_class(self):
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            feature_extractor = Wav2Vec2FeatureExtractor()
-            tokenizer = AutoTokenizer.from_pretrained("facebook/wav2vec2-base-960h")
+def _from_feat_extr_processor_class(tmpdirname):
+    _save_local_processor(tmpdirname)
+    # drop `processor_class` in tokenizer
+    _drop_processor_class(tmpdirname, TOKENIZER_CONFIG_FILE)
 
-            processor = Wav2Vec2Processor(feature_extractor, tokenizer)
 
-            # save in new folder
-            processor.save_pretrained(tmpdirname)
+def _from_tokenizer_processor_class(tmpdirname):
+    _save_local_processor(tmpdirname)
+    # drop `processor_class` in feature extractor
+    _drop_processor_class(tmpdirname, FEATURE_EXTRACTOR_NAME)
 
-            # drop `processor_class` in feature extractor
-            with open(os.path.join(tmpdirname, FEATURE_EXTRACTOR_NAME), "r") as f:
-                config_dict = json.load(f)
-                config_dict.pop("processor_class")
 
-            with open(os.path.join(tmpdirname, FEATURE_EXTRACTOR_NAME), "w") as f:
-                f.write(json.dumps(config_dict))
+def _from_model_config(tmpdirname):
+    model_config = Wav2Vec2Config(processor_class="Wav2Vec2Processor")
+    model_config.save_pretrained(tmpdirname)
+    # copy relevant files
+    _link_or_copy(SAMPLE_VOCAB, os.path.join(tmpdirname, "vocab.json"))
+    # create emtpy sample processor
+    with open(os.path.join(tmpdirname, FEATURE_EXTRACTOR_NAME), "w") as f:
+        f.write("{}")
 
-            processor = AutoProcessor.from_pretrained(tmpdirname)
 
+class AutoFeatureExtractorTest(unittest.TestCase):
+    def test_processor_from_model_shortcut(self):
+        processor = AutoProcessor.from_pretrained("facebook/wav2vec2-base-960h")
         self.assertIsInstance(processor, Wav2Vec2Processor)
 
-    def test_processor_from_local_directory_from_model_config(self):
+    @parameterized.expand(
+        [
+            ("local_directory_from_saved_processor", _from_saved_processor),
+            ("local_directory_from_extractor_config", _from_extractor_config),
+            ("feat_extr_processor_class", _from_feat_extr_processor_class),
+            ("tokenizer_processor_class", _from_tokenizer_processor_class),
+            ("local_directory_from_model_config", _from_model_config),
+        ]
+    )
+    def test_processor_from(self, _, prepare_dir):
         with tempfile.TemporaryDirectory() as tmpdirname:
-            model_config = Wav2Vec2Config(processor_class="Wav2Vec2Processor")
-            model_config.save_pretrained(tmpdirname)
-            # copy relevant files
-            copyfile(SAMPLE_VOCAB, os.path.join(tmpdirname, "vocab.json"))
-            # create emtpy sample processor
-            with open(os.path.join(tmpdirname, FEATURE_EXTRACTOR_NAME), "w") as f:
-                f.write("{}")
+            prepare_dir(tmpdirname)
 
             processor = AutoProcessor.from_pretrained(tmpdirname)
 
         self.assertIsInstance(processor, Wav2Vec2Processor)
 
+
+class AutoProcessorDynamicTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Local snapshot for the slow-tokenizer variant, the default load goes through the Hub repo id
+        cls._dynamic_processor_dir = snapshot_download("hf-internal-testing/test_dynamic_processor")
+
     def test_from_pretrained_dynamic_processor(self):
         processor = AutoProcessor.from_pretrained("hf-internal-testing/test_dynamic_processor", trust_remote_code=True)
         self.assertTrue(processor.special_attribute_present)
@@ -143,78 +150,106 @@ class AutoFeatureExtractorTest(unittest.TestCase):
         self.assertTrue(tokenizer.special_attribute_present)
         if is_tokenizers_available():
             self.assertEqual(tokenizer.__class__.__name__, "NewTokenizerFast")
-
-            # Test we can also load the slow version
-            processor = AutoProcessor.from_pretrained(
-                "hf-internal-testing/test_dynamic_processor", trust_remote_code=True, use_fast=False
-            )
-            tokenizer = processor.tokenizer
-            self.assertTrue(tokenizer.special_attribute_present)
-            self.assertEqual(tokenizer.__class__.__name__, "NewTokenizer")
         else:
             self.assertEqual(tokenizer.__class__.__name__, "NewTokenizer")
 
+    def test_from_pretrained_dynamic_processor_slow_tokenizer(self):
+        # Test we can also load the slow version
+        processor = AutoProcessor.from_pretrained(self._dynamic_processor_dir, trust_remote_code=True, use_fast=False)
+        tokenizer = processor.tokenizer
+        self.assertTrue(tokenizer.special_attribute_present)
+        self.assertEqual(tokenizer.__class__.__name__, "NewTokenizer")
 
-@is_staging_test
-class ProcessorPushToHubTester(unittest.TestCase):
+
+class CustomProcessorTesterMixin:
     vocab_tokens = ["[UNK]", "[CLS]", "[SEP]", "[PAD]", "[MASK]", "bla", "blou"]
 
     @classmethod
     def setUpClass(cls):
+        cls._feature_extractor = CustomFeatureExtractor.from_pretrained(SAMPLE_FEATURE_EXTRACTION_CONFIG_DIR)
+
+        # Single temporary root holding both the vocab file and the saved processors
+        cls._tmp_dir = tempfile.TemporaryDirectory()
+        vocab_file = os.path.join(cls._tmp_dir.name, "vocab.txt")
+        with open(vocab_file, "w", encoding="utf-8") as vocab_writer:
+            vocab_writer.write("".join([x + "\n" for x in cls.vocab_tokens]))
+        cls._tokenizer = CustomTokenizer(vocab_file)
+
+        # The auto-class registration is global, so it comes last (nothing after it can fail and skip
+        # `tearDownClass`) and the previous state is restored in `tearDownClass`
+        cls._previous_auto_classes = {
+            klass: klass._auto_class for klass in (CustomFeatureExtractor, CustomTokenizer, CustomProcessor)
+        }
+        CustomFeatureExtractor.register_for_auto_class()
+        CustomTokenizer.register_for_auto_class()
+        CustomProcessor.register_for_auto_class()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp_dir.cleanup()
+        for klass, auto_class in cls._previous_auto_classes.items():
+            klass._auto_class = auto_class
+
+    def get_custom_processor(self):
+        return CustomProcessor(self._feature_extractor, self._tokenizer)
+
+
+class ProcessorSaveDynamicTest(CustomProcessorTesterMixin, unittest.TestCase):
+    def test_save_dynamic_processor(self):
+        processor = self.get_custom_processor()
+
+        tmp_dir = os.path.join(self._tmp_dir.name, "dynamic-processor")
+        processor.save_pretrained(tmp_dir)
+
+        # This has added the proper auto_map field to the feature extractor config
+        self.assertDictEqual(
+            processor.feature_extractor.auto_map,
+            {
+                "AutoFeatureExtractor": "custom_feature_extraction.CustomFeatureExtractor",
+                "AutoProcessor": "custom_processing.CustomProcessor",
+            },
+        )
+
+        # This has added the proper auto_map field to the tokenizer config
+        with open(os.path.join(tmp_dir, "tokenizer_config.json")) as f:
+            tokenizer_config = json.load(f)
+        self.assertDictEqual(
+            tokenizer_config["auto_map"],
+            {
+                "AutoTokenizer": ["custom_tokenization.CustomTokenizer", None],
+                "AutoProcessor": "custom_processing.CustomProcessor",
+            },
+        )
+
+        # The code has been copied from fixtures
+        self.assertTrue(os.path.isfile(os.path.join(tmp_dir, "custom_feature_extraction.py")))
+        self.assertTrue(os.path.isfile(os.path.join(tmp_dir, "custom_tokenization.py")))
+        self.assertTrue(os.path.isfile(os.path.join(tmp_dir, "custom_processing.py")))
+
+
+@is_staging_test
+class ProcessorPushToHubTester(CustomProcessorTesterMixin, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Log in first: if it fails, `tearDownClass` is not called, so nothing must be registered yet
         cls._token = login(username=USER, password=PASS)
+        super().setUpClass()
 
     @classmethod
     def tearDownClass(cls):
+        super().tearDownClass()
         try:
             delete_repo(token=cls._token, name="test-dynamic-processor")
         except HTTPError:
             pass
 
     def test_push_to_hub_dynamic_processor(self):
-        CustomFeatureExtractor.register_for_auto_class()
-        CustomTokenizer.register_for_auto_class()
-        CustomProcessor.register_for_auto_class()
+        processor = self.get_custom_processor()
 
-        feature_extractor = CustomFeatureExtractor.from_pretrained(SAMPLE_FEATURE_EXTRACTION_CONFIG_DIR)
-
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            vocab_file = os.path.join(tmp_dir, "vocab.txt")
-            with open(vocab_file, "w", encoding="utf-8") as vocab_writer:
-                vocab_writer.write("".join([x + "\n" for x in self.vocab_tokens]))
-            tokenizer = CustomTokenizer(vocab_file)
-
-        processor = CustomProcessor(feature_extractor, tokenizer)
-
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            repo = Repository(tmp_dir, clone_from=f"{USER}/test-dynamic-processor", use_auth_token=self._token)
-            processor.save_pretrained(tmp_dir)
-
-            # This has added the proper auto_map field to the feature extractor config
-            self.assertDictEqual(
-                processor.feature_extractor.auto_map,
-                {
-                    "AutoFeatureExtractor": "custom_feature_extraction.CustomFeatureExtractor",
-                    "AutoProcessor": "custom_processing.CustomProcessor",
-                },
-            )
-
-            # This has added the proper auto_map field to the tokenizer config
-            with open(os.path.join(tmp_dir, "tokenizer_config.json")) as f:
-                tokenizer_config = json.load(f)
-            self.assertDictEqual(
-                tokenizer_config["auto_map"],
-                {
-                    "AutoTokenizer": ["custom_tokenization.CustomTokenizer", None],
-                    "AutoProcessor": "custom_processing.CustomProcessor",
-                },
-            )
-
-            # The code has been copied from fixtures
-            self.assertTrue(os.path.isfile(os.path.join(tmp_dir, "custom_feature_extraction.py")))
-            self.assertTrue(os.path.isfile(os.path.join(tmp_dir, "custom_tokenization.py")))
-            self.assertTrue(os.path.isfile(os.path.join(tmp_dir, "custom_processing.py")))
-
-            repo.push_to_hub()
+        tmp_dir = os.path.join(self._tmp_dir.name, "test-dynamic-processor")
+        repo = Repository(tmp_dir, clone_from=f"{USER}/test-dynamic-processor", use_auth_token=self._token)
+        processor.save_pretrained(tmp_dir)
+        repo.push_to_hub()
 
         new_processor = AutoProcessor.from_pretrained(f"{USER}/test-dynamic-processor", trust_remote_code=True)
         # Can't make an isinstance check because the new_processor is from the CustomProcessor class of a dynamic module